@@ -95,7 +95,7 @@ if command -v starship >/dev/null 2>&1
 
     # Manual sync command: run after changing ghostty theme
     function sync-starship-theme --description "Re-sync starship palette from current Ghostty theme"
-        python3 "$__starship_sync_script" --template "$__starship_template" --output "$__starship_generated"
+        python3 "$__starship_sync_script" --template "$__starship_template" --output "$__starship_generated" --force
         and echo "Starship palette synced from Ghostty theme."
         or echo "Failed to sync starship palette."
     end
@@ -1,16 +1,30 @@
 #!/usr/bin/env python3
 
 import argparse
-import colorsys
+import functools
+import hashlib
+import json
+import os
 import re
+import shutil
 import subprocess
+import tempfile
 from pathlib import Path
 
 
 PALETTE_NAME = "ghostty_dynamic"
-HEX_RE = re.compile(r"^#([0-9a-fA-F]{6})$")
-PALETTE_LINE_RE = re.compile(r"^(\d+)\s*=\s*(#[0-9a-fA-F]{6})$")
-KEY_VALUE_RE = re.compile(r"^([a-z0-9-]+)\s*=\s*(.+)$")
+SCRIPT_PATH = Path(__file__).resolve()
+SIGNATURE_CACHE_NAME = "starship-ghostty-palette.sha"
+GHOSTTY_CACHE_NAME = "starship-ghostty-palette.json"
+HEX_DIGITS = "0123456789abcdefABCDEF"
+# One pass over a `ghostty +show-config` line: either `palette = N=#rrggbb`
+# or one of the named colors we consume; everything else is skipped.
+GHOSTTY_LINE_RE = re.compile(
+    r"^(?:palette\s*=\s*(?P<idx>\d+)\s*=\s*(?P<pcol>#[0-9a-fA-F]{6})"
+    r"|(?P<key>foreground|background|selection-background)"
+    r"\s*=\s*(?P<col>#[0-9a-fA-F]{6}))\s*$"
+)
+PALETTE_ASSIGN_RE = re.compile(r"^palette\s*=\s*['\"][^'\"]+['\"]\s*$")
 
 DARK_BACKGROUND_LUMINANCE_THRESHOLD = 0.26
 DARK_THEME_MIN_SATURATION = 0.4
@@ -21,21 +35,39 @@ LIGHT_THEME_MIN_SATURATION = 0.45
 LIGHT_ACCENT_MIN_CONTRAST = 4.0
 LIGHT_ACCENT_MAX_LUMINANCE = 0.35
 
+# sRGB -> linear-light lookup for every 8-bit channel value, built once at import
+_SRGB_LUT = tuple(
+    (v / 255) / 12.92 if v / 255 <= 0.04045 else ((v / 255 + 0.055) / 1.055) ** 2.4
+    for v in range(256)
+)
 
+
+@functools.lru_cache(maxsize=512)
 def normalize_hex(value: str) -> str | None:
-    match = HEX_RE.match(value.strip())
-    if not match:
+    value = value.strip()
+    # Stripping every hex digit from the body leaves nothing for a valid color
+    if len(value) != 7 or value[0] != "#" or value[1:].strip(HEX_DIGITS):
         return None
-    return f"#{match.group(1).lower()}"
+    return value.lower()
 
 
+@functools.lru_cache(maxsize=512)
 def hex_to_rgb(value: str) -> tuple[int, int, int]:
-    raw = value.lstrip("#")
-    return int(raw[0:2], 16), int(raw[2:4], 16), int(raw[4:6], 16)
+    packed = int(value.lstrip("#"), 16)
+    return (packed >> 16) & 0xFF, (packed >> 8) & 0xFF, packed & 0xFF
+
+
+def hex_to_linear(value: str) -> tuple[float, float, float]:
+    packed = int(value.lstrip("#"), 16)
+    return (
+        _SRGB_LUT[(packed >> 16) & 0xFF],
+        _SRGB_LUT[(packed >> 8) & 0xFF],
+        _SRGB_LUT[packed & 0xFF],
+    )
 
 
 def rgb_to_hex(rgb: tuple[int, int, int]) -> str:
-    return f"#{rgb[0]:02x}{rgb[1]:02x}{rgb[2]:02x}"
+    return f"#{(rgb[0] << 16) | (rgb[1] << 8) | rgb[2]:06x}"
 
 
 def blend(a: str, b: str, amount: float) -> str:
@@ -48,10 +80,7 @@ def blend(a: str, b: str, amount: float) -> str:
 
 
 def channel_to_linear(channel: int) -> float:
-    value = channel / 255
-    if value <= 0.04045:
-        return value / 12.92
-    return ((value + 0.055) / 1.055) ** 2.4
+    return _SRGB_LUT[channel]
 
 
 def linear_to_channel(value: float) -> int:
@@ -63,125 +92,151 @@ def linear_to_channel(value: float) -> int:
     return round(srgb * 255)
 
 
-def relative_luminance(color: str) -> float:
-    r, g, b = hex_to_rgb(color)
-    rl = channel_to_linear(r)
-    gl = channel_to_linear(g)
-    bl = channel_to_linear(b)
-    return 0.2126 * rl + 0.7152 * gl + 0.0722 * bl
+def linear_to_hex(rgb: tuple[float, float, float]) -> str:
+    return rgb_to_hex(
+        (
+            linear_to_channel(rgb[0]),
+            linear_to_channel(rgb[1]),
+            linear_to_channel(rgb[2]),
+        )
+    )
 
 
-def contrast_ratio(a: str, b: str) -> float:
-    la = relative_luminance(a)
-    lb = relative_luminance(b)
-    lighter = max(la, lb)
-    darker = min(la, lb)
-    return (lighter + 0.05) / (darker + 0.05)
+@functools.lru_cache(maxsize=512)
+def relative_luminance(color: str) -> float:
+    rl, gl, bl = hex_to_linear(color)
+    return 0.2126 * rl + 0.7152 * gl + 0.0722 * bl
 
 
-def best_contrast_text(background: str, candidates: list[str]) -> str:
+@functools.lru_cache(maxsize=64)
+def unique_hex_candidates(candidates: tuple[str, ...]) -> tuple[str, ...]:
     unique_candidates: list[str] = []
     for color in candidates:
         normalized = normalize_hex(color)
         if normalized is not None and normalized not in unique_candidates:
             unique_candidates.append(normalized)
-
-    if not unique_candidates:
-        return "#ffffff"
-
-    return max(unique_candidates, key=lambda color: contrast_ratio(background, color))
-
-
-def ensure_min_saturation_hsv(color: str, min_saturation: float) -> str:
-    if min_saturation <= 0.0:
-        return color
-
-    r8, g8, b8 = hex_to_rgb(color)
-    h, s, v = colorsys.rgb_to_hsv(r8 / 255, g8 / 255, b8 / 255)
-    boosted = colorsys.hsv_to_rgb(h, max(s, min(1.0, min_saturation)), v)
-    return rgb_to_hex(
-        (
-            round(boosted[0] * 255),
-            round(boosted[1] * 255),
-            round(boosted[2] * 255),
-        )
+    return tuple(unique_candidates)
+
+
+def best_contrast_text(
+    bg_lum: float, candidate_lums: tuple[tuple[str, float], ...]
+) -> str:
+    best = "#ffffff"
+    best_ratio = 0.0
+    for color, lum in candidate_lums:
+        ratio = (max(bg_lum, lum) + 0.05) / (min(bg_lum, lum) + 0.05)
+        if ratio > best_ratio:
+            best, best_ratio = color, ratio
+    return best
+
+
+def boost_saturation(
+    rgb: tuple[int, int, int], min_saturation: float
+) -> tuple[int, int, int]:
+    r8, g8, b8 = rgb
+    hi = max(r8, g8, b8)
+    lo = min(r8, g8, b8)
+    target = min(1.0, min_saturation)
+    if hi == 0 or (hi - lo) / hi >= target:
+        return rgb
+
+    v = hi / 255
+    if hi == lo:
+        # Gray has hue 0 in HSV, so boosting saturation tints it red
+        low = round(v * (1.0 - target) * 255)
+        return hi, low, low
+
+    # At fixed hue and value each channel sits at a fixed fraction of the
+    # max-min span, so the boosted channels follow directly from the target.
+    span = hi - lo
+    return (
+        round(v * (1.0 - target * (hi - r8) / span) * 255),
+        round(v * (1.0 - target * (hi - g8) / span) * 255),
+        round(v * (1.0 - target * (hi - b8) / span) * 255),
     )
 
 
-def scale_luminance(color: str, target_lum: float) -> str:
-    """Scale a color to reach target luminance while preserving chromaticity."""
-    r, g, b = hex_to_rgb(color)
-    rl = channel_to_linear(r)
-    gl = channel_to_linear(g)
-    bl = channel_to_linear(b)
-    current_lum = 0.2126 * rl + 0.7152 * gl + 0.0722 * bl
+def scale_linear(
+    rgb: tuple[float, float, float], current_lum: float, target_lum: float
+) -> tuple[tuple[float, float, float], float]:
+    """Scale linear-light RGB toward target luminance, staying in gamut.
 
+    Returns the scaled channels together with their new luminance.
+    """
     if current_lum < 0.001:
-        return color
+        return rgb, current_lum
 
+    rl, gl, bl = rgb
     factor = target_lum / current_lum
-    new_r = rl * factor
-    new_g = gl * factor
-    new_b = bl * factor
 
     # If any channel overflows, reduce factor to stay in gamut
-    max_val = max(new_r, new_g, new_b)
+    max_val = max(rl, gl, bl) * factor
     if max_val > 1.0:
         factor /= max_val
-        new_r = rl * factor
-        new_g = gl * factor
-        new_b = bl * factor
 
-    return rgb_to_hex(
-        (
-            linear_to_channel(new_r),
-            linear_to_channel(new_g),
-            linear_to_channel(new_b),
-        )
-    )
+    return (rl * factor, gl * factor, bl * factor), current_lum * factor
 
 
-def load_ghostty_config(ghostty_cmd: str) -> dict:
+def run_ghostty_show_config(ghostty_cmd: str) -> dict:
     try:
-        result = subprocess.run(
+        proc = subprocess.Popen(
             [ghostty_cmd, "+show-config"],
-            check=True,
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
             text=True,
         )
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    except FileNotFoundError:
         return {}
 
     palette: dict[int, str] = {}
     parsed: dict[str, str | dict[int, str]] = {"palette": palette}
 
-    for raw_line in result.stdout.splitlines():
-        line = raw_line.strip()
-        if not line or line.startswith("#"):
-            continue
-
-        kv = KEY_VALUE_RE.match(line)
-        if not kv:
-            continue
-
-        key, value = kv.group(1), kv.group(2).strip()
-        if key == "palette":
-            palette_match = PALETTE_LINE_RE.match(value)
-            if palette_match:
-                idx = int(palette_match.group(1))
-                color = normalize_hex(palette_match.group(2))
-                if color is not None:
-                    palette[idx] = color
-            continue
-
-        if key in {"foreground", "background", "selection-background"}:
-            color = normalize_hex(value)
-            if color is not None:
-                parsed[key.replace("-", "_")] = color
+    # Parse lines as ghostty emits them instead of buffering all of stdout
+    with proc:
+        for raw_line in proc.stdout:
+            match = GHOSTTY_LINE_RE.match(raw_line.strip())
+            if not match:
+                continue
+
+            idx = match.group("idx")
+            if idx is not None:
+                palette[int(idx)] = match.group("pcol").lower()
+            else:
+                key = match.group("key").replace("-", "_")
+                parsed[key] = match.group("col").lower()
+
+    if proc.returncode != 0:
+        return {}
 
     return parsed
 
 
+def load_ghostty_config(
+    ghostty_cmd: str, variant: str = "", use_cache: bool = True
+) -> dict:
+    """Parse ghostty's resolved config, reusing a cached parse when possible.
+
+    The cache is keyed on the ghostty binary and config file stats plus
+    ``variant``, which callers use for state ghostty's files don't capture
+    (e.g. the macOS appearance baked into the output path).
+    """
+    cache_path = ghostty_cache_path()
+    key = ghostty_config_key(ghostty_cmd, variant)
+    if use_cache and key is not None:
+        cached = read_ghostty_cache(cache_path, key)
+        if cached is not None:
+            return cached
+
+    parsed = run_ghostty_show_config(ghostty_cmd)
+    if parsed and key is not None:
+        # The cache is only an optimization; never let it block the sync
+        try:
+            write_if_changed(cache_path, json.dumps({"key": key, "config": parsed}))
+        except OSError:
+            pass
+    return parsed
+
+
 def build_starship_palette(parsed: dict) -> dict[str, str]:
     colors = parsed.get("palette", {})
 
@@ -204,76 +259,71 @@ def build_starship_palette(parsed: dict) -> dict[str, str]:
     bg_lum = relative_luminance(background)
     is_dark = bg_lum < DARK_BACKGROUND_LUMINANCE_THRESHOLD
 
+    # Contrast targets depend only on the background, so compute them once
+    # and run every accent through the same single pass.
     if is_dark:
-        red = ensure_min_saturation_hsv(red, DARK_THEME_MIN_SATURATION)
-        green = ensure_min_saturation_hsv(green, DARK_THEME_MIN_SATURATION)
-        yellow = ensure_min_saturation_hsv(yellow, DARK_THEME_MIN_SATURATION)
-        blue = ensure_min_saturation_hsv(blue, DARK_THEME_MIN_SATURATION)
-        purple = ensure_min_saturation_hsv(purple, DARK_THEME_MIN_SATURATION)
-        aqua = ensure_min_saturation_hsv(aqua, DARK_THEME_MIN_SATURATION)
-        orange = ensure_min_saturation_hsv(orange, DARK_THEME_MIN_SATURATION)
-
-        def _ensure_dark_contrast(c: str) -> str:
+        dark_target_lum = DARK_ACCENT_MIN_CONTRAST * (bg_lum + 0.05) - 0.05
+        dark_target_lum = max(dark_target_lum, 0.15)
+
+        def _adjust_accent(c: str) -> str:
+            # Decode once and stay in linear light until the final encode
+            r8, g8, b8 = boost_saturation(hex_to_rgb(c), DARK_THEME_MIN_SATURATION)
+            rgb = (_SRGB_LUT[r8], _SRGB_LUT[g8], _SRGB_LUT[b8])
+            lum = 0.2126 * rgb[0] + 0.7152 * rgb[1] + 0.0722 * rgb[2]
             # Floor: ensure minimum contrast
-            if contrast_ratio(c, background) < DARK_ACCENT_MIN_CONTRAST:
-                target_lum = DARK_ACCENT_MIN_CONTRAST * (bg_lum + 0.05) - 0.05
-                target_lum = max(target_lum, 0.15)
-                c = scale_luminance(c, target_lum)
+            contrast = (max(lum, bg_lum) + 0.05) / (min(lum, bg_lum) + 0.05)
+            if contrast < DARK_ACCENT_MIN_CONTRAST:
+                rgb, lum = scale_linear(rgb, lum, dark_target_lum)
             # Ceiling: cap luminance so accents aren't washed out / pastel
-            if relative_luminance(c) > DARK_ACCENT_MAX_LUMINANCE:
-                c = scale_luminance(c, DARK_ACCENT_MAX_LUMINANCE)
-            return c
-
-        red = _ensure_dark_contrast(red)
-        green = _ensure_dark_contrast(green)
-        yellow = _ensure_dark_contrast(yellow)
-        blue = _ensure_dark_contrast(blue)
-        purple = _ensure_dark_contrast(purple)
-        aqua = _ensure_dark_contrast(aqua)
-        orange = _ensure_dark_contrast(orange)
+            if lum > DARK_ACCENT_MAX_LUMINANCE:
+                rgb, lum = scale_linear(rgb, lum, DARK_ACCENT_MAX_LUMINANCE)
+            return linear_to_hex(rgb)
+
     else:
         # Light theme: boost saturation and darken colors for contrast on bright bg
-        red = ensure_min_saturation_hsv(red, LIGHT_THEME_MIN_SATURATION)
-        green = ensure_min_saturation_hsv(green, LIGHT_THEME_MIN_SATURATION)
-        yellow = ensure_min_saturation_hsv(yellow, LIGHT_THEME_MIN_SATURATION)
-        blue = ensure_min_saturation_hsv(blue, LIGHT_THEME_MIN_SATURATION)
-        purple = ensure_min_saturation_hsv(purple, LIGHT_THEME_MIN_SATURATION)
-        aqua = ensure_min_saturation_hsv(aqua, LIGHT_THEME_MIN_SATURATION)
-        orange = ensure_min_saturation_hsv(orange, LIGHT_THEME_MIN_SATURATION)
-
-        def _ensure_light_contrast(c: str) -> str:
-            cr = contrast_ratio(c, background)
-            if cr < LIGHT_ACCENT_MIN_CONTRAST:
-                # Darken: target luminance such that contrast ratio meets minimum
-                target_lum = (bg_lum + 0.05) / LIGHT_ACCENT_MIN_CONTRAST - 0.05
-                target_lum = min(target_lum, LIGHT_ACCENT_MAX_LUMINANCE)
-                target_lum = max(target_lum, 0.03)
-                return scale_luminance(c, target_lum)
-            return c
-
-        red = _ensure_light_contrast(red)
-        green = _ensure_light_contrast(green)
-        yellow = _ensure_light_contrast(yellow)
-        blue = _ensure_light_contrast(blue)
-        purple = _ensure_light_contrast(purple)
-        aqua = _ensure_light_contrast(aqua)
-        orange = _ensure_light_contrast(orange)
+        # Darken: target luminance such that contrast ratio meets minimum
+        light_target_lum = (bg_lum + 0.05) / LIGHT_ACCENT_MIN_CONTRAST - 0.05
+        light_target_lum = min(light_target_lum, LIGHT_ACCENT_MAX_LUMINANCE)
+        light_target_lum = max(light_target_lum, 0.03)
+
+        def _adjust_accent(c: str) -> str:
+            r8, g8, b8 = boost_saturation(hex_to_rgb(c), LIGHT_THEME_MIN_SATURATION)
+            rgb = (_SRGB_LUT[r8], _SRGB_LUT[g8], _SRGB_LUT[b8])
+            lum = 0.2126 * rgb[0] + 0.7152 * rgb[1] + 0.0722 * rgb[2]
+            contrast = (max(lum, bg_lum) + 0.05) / (min(lum, bg_lum) + 0.05)
+            if contrast >= LIGHT_ACCENT_MIN_CONTRAST:
+                return rgb_to_hex((r8, g8, b8))
+            rgb, _ = scale_linear(rgb, lum, light_target_lum)
+            return linear_to_hex(rgb)
+
+    red, green, yellow, blue, purple, aqua, orange = (
+        _adjust_accent(c) for c in (red, green, yellow, blue, purple, aqua, orange)
+    )
 
     # Offset bg1 from terminal background so prompt segments are visible
     # Blend slightly toward foreground to create visual separation
     prompt_bg = blend(background, foreground, 0.12)
 
-    contrast_candidates = [foreground, background, "#ffffff", "#000000"]
+    # Candidate luminances are fixed for the whole palette; compute them once
+    contrast_candidates = tuple(
+        (color, relative_luminance(color))
+        for color in unique_hex_candidates(
+            (foreground, background, "#ffffff", "#000000")
+        )
+    )
+
+    def _text_on(color: str) -> str:
+        return best_contrast_text(relative_luminance(color), contrast_candidates)
 
-    on_bg1 = best_contrast_text(prompt_bg, contrast_candidates)
-    on_bg3 = best_contrast_text(selection_background, contrast_candidates)
-    on_blue = best_contrast_text(blue, contrast_candidates)
-    on_aqua = best_contrast_text(aqua, contrast_candidates)
-    on_green = best_contrast_text(green, contrast_candidates)
-    on_orange = best_contrast_text(orange, contrast_candidates)
-    on_purple = best_contrast_text(purple, contrast_candidates)
-    on_red = best_contrast_text(red, contrast_candidates)
-    on_yellow = best_contrast_text(yellow, contrast_candidates)
+    on_bg1 = _text_on(prompt_bg)
+    on_bg3 = _text_on(selection_background)
+    on_blue = _text_on(blue)
+    on_aqua = _text_on(aqua)
+    on_green = _text_on(green)
+    on_orange = _text_on(orange)
+    on_purple = _text_on(purple)
+    on_red = _text_on(red)
+    on_yellow = _text_on(yellow)
 
     return {
         "color_fg0": foreground,
@@ -298,86 +348,183 @@ def build_starship_palette(parsed: dict) -> dict[str, str]:
     }
 
 
-def ensure_palette_name(config_text: str) -> str:
+def ensure_palette_name(lines: list[str]) -> list[str]:
     palette_line = f"palette = '{PALETTE_NAME}'"
-    pattern = re.compile(r"^palette\s*=\s*['\"][^'\"]+['\"]\s*$", re.MULTILINE)
-    if pattern.search(config_text):
-        return pattern.sub(palette_line, config_text, count=1)
-
-    lines = config_text.splitlines()
-    insert_at = 0
     for idx, line in enumerate(lines):
-        if line.strip().startswith("["):
-            insert_at = idx
-            break
-    else:
-        insert_at = len(lines)
-
-    lines.insert(insert_at, "")
-    lines.insert(insert_at, palette_line)
-    return "\n".join(lines) + "\n"
+        # Cheap prefix test first; the regex only runs on candidate lines
+        if line.startswith("palette") and PALETTE_ASSIGN_RE.match(line):
+            if line != palette_line:
+                lines[idx] = palette_line
+            return lines
+
+    insert_at = next(
+        (idx for idx, line in enumerate(lines) if line.strip().startswith("[")),
+        len(lines),
+    )
+    lines[insert_at:insert_at] = [palette_line, ""]
+    return lines
 
 
-def update_palette_section(config_text: str, values: dict[str, str]) -> str:
+def update_palette_section(lines: list[str], values: dict[str, str]) -> list[str]:
     section_header = f"[palettes.{PALETTE_NAME}]"
-    lines = config_text.splitlines()
+    # Format each replacement line once up front and index it below
+    prebuilt = {key: f"{key} = '{value}'" for key, value in values.items()}
+
+    start = next(
+        (idx + 1 for idx, line in enumerate(lines) if line.strip() == section_header),
+        None,
+    )
+    if start is None:
+        if lines and lines[-1].strip() != "":
+            lines.append("")
+        lines.append(section_header)
+        lines.extend(prebuilt.values())
+        return lines
+
+    end = len(lines)
+    for idx in range(start, len(lines)):
+        stripped = lines[idx].strip()
+        if stripped.startswith("[") and stripped.endswith("]"):
+            end = idx
+            break
 
-    output: list[str] = []
-    in_section = False
-    found_section = False
+    # Only the palette section's own lines are inspected; everything around
+    # it is spliced back untouched.
+    section: list[str] = []
     seen: set[str] = set()
+    for line in lines[start:end]:
+        key, sep, _ = line.partition("=")
+        key = key.strip()
+        replacement = prebuilt.get(key) if sep else None
+        if replacement is not None:
+            indent = line[: len(line) - len(line.lstrip())]
+            section.append(indent + replacement)
+            seen.add(key)
+        else:
+            section.append(line)
+    section.extend(text for key, text in prebuilt.items() if key not in seen)
+
+    lines[start:end] = section
+    return lines
+
+
+def file_matches(path: Path, data: bytes) -> bool:
+    try:
+        if path.stat().st_size != len(data):
+            return False
+        digest = hashlib.blake2b()
+        with path.open("rb") as fh:
+            for chunk in iter(lambda: fh.read(64 * 1024), b""):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return False
+    return digest.digest() == hashlib.blake2b(data).digest()
 
-    for line in lines:
-        stripped = line.strip()
 
-        if stripped.startswith("[") and stripped.endswith("]"):
-            if in_section:
-                for key, value in values.items():
-                    if key not in seen:
-                        output.append(f"{key} = '{value}'")
-                in_section = False
-
-            if stripped == section_header:
-                found_section = True
-                in_section = True
-                output.append(line)
-                continue
+def write_if_changed(path: Path, content: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = content.encode()
+    if file_matches(path, data):
+        return
+
+    # Write beside the target and rename over it so readers (starship on the
+    # next prompt) never see a partially written file.
+    tmp = tempfile.NamedTemporaryFile(
+        mode="wb", dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False
+    )
+    try:
+        with tmp:
+            tmp.write(data)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        # NamedTemporaryFile is created 0600; keep the mode a plain write gives
+        try:
+            mode = path.stat().st_mode & 0o777
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp.name, mode)
+        os.replace(tmp.name, path)
+    except BaseException:
+        Path(tmp.name).unlink(missing_ok=True)
+        raise
+
+
+def stat_signature(path: Path) -> tuple[int, int] | None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def ghostty_config_paths() -> list[Path]:
+    config_home = os.environ.get("XDG_CONFIG_HOME") or Path.home() / ".config"
+    return [
+        Path(config_home) / "ghostty" / "config",
+        Path.home()
+        / "Library"
+        / "Application Support"
+        / "com.mitchellh.ghostty"
+        / "config",
+    ]
+
+
+def ghostty_cache_path() -> Path:
+    cache_dir = (
+        os.environ.get("XDG_RUNTIME_DIR")
+        or os.environ.get("XDG_CACHE_HOME")
+        or Path.home() / ".cache"
+    )
+    return Path(cache_dir) / GHOSTTY_CACHE_NAME
 
-        if in_section:
-            match = re.match(
-                r"^(\s*)([A-Za-z0-9_]+)\s*=\s*(['\"])([^'\"]*)(['\"])\s*$",
-                line,
-            )
-            if match:
-                indent = match.group(1)
-                key = match.group(2)
-                if key in values:
-                    output.append(f"{indent}{key} = '{values[key]}'")
-                    seen.add(key)
-                    continue
 
-        output.append(line)
+def ghostty_config_key(ghostty_cmd: str, variant: str) -> str | None:
+    ghostty_path = shutil.which(ghostty_cmd)
+    if ghostty_path is None:
+        return None
+    ghostty_path = os.path.realpath(ghostty_path)
+    parts = [
+        (str(SCRIPT_PATH), stat_signature(SCRIPT_PATH)),
+        (ghostty_path, stat_signature(Path(ghostty_path))),
+        variant,
+        *((str(path), stat_signature(path)) for path in ghostty_config_paths()),
+    ]
+    return repr(parts)
 
-    if in_section:
-        for key, value in values.items():
-            if key not in seen:
-                output.append(f"{key} = '{value}'")
 
-    if not found_section:
-        if output and output[-1].strip() != "":
-            output.append("")
-        output.append(section_header)
-        for key, value in values.items():
-            output.append(f"{key} = '{value}'")
+def read_ghostty_cache(cache_path: Path, key: str) -> dict | None:
+    try:
+        cached = json.loads(cache_path.read_text())
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("key") != key:
+        return None
 
-    return "\n".join(output) + "\n"
+    parsed = cached.get("config") or {}
+    # JSON object keys are strings; palette indices are ints everywhere else
+    parsed["palette"] = {int(idx): c for idx, c in parsed.get("palette", {}).items()}
+    return parsed
 
 
-def write_if_changed(path: Path, content: str) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    if path.exists() and path.read_text() == content:
-        return
-    path.write_text(content)
+def signature_cache_path() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / SIGNATURE_CACHE_NAME
+
+
+def pipeline_signature(template_path: Path, output_path: Path, ghostty_cmd: str) -> str:
+    """Fingerprint every input that can change the generated config."""
+    ghostty_path = shutil.which(ghostty_cmd)
+    parts = [
+        # Regenerate after dotfiles updates change how the palette is built
+        (str(SCRIPT_PATH), stat_signature(SCRIPT_PATH)),
+        (str(template_path), stat_signature(template_path)),
+        (str(output_path), stat_signature(output_path)),
+        (ghostty_path, stat_signature(Path(ghostty_path)) if ghostty_path else None),
+        *((str(path), stat_signature(path)) for path in ghostty_config_paths()),
+    ]
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
 
 
 def main() -> int:
@@ -395,20 +542,50 @@ def main() -> int:
         default="ghostty",
         help="Ghostty executable name/path (default: ghostty)",
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate even if no input changed since the last run",
+    )
     args = parser.parse_args()
 
     template_path = Path(args.template).expanduser()
     output_path = Path(args.output).expanduser()
 
+    # Skip spawning ghostty entirely when template, binary, ghostty config
+    # and the previously generated output are all unchanged.
+    cache_path = signature_cache_path()
+    if not args.force and output_path.exists():
+        try:
+            cached = cache_path.read_text().strip()
+        except OSError:
+            cached = None
+        if cached == pipeline_signature(template_path, output_path, args.ghostty_cmd):
+            return 0
+
     template_text = template_path.read_text()
     rendered = template_text
 
-    parsed = load_ghostty_config(args.ghostty_cmd)
+    # The fish config writes one output per macOS appearance, and ghostty's
+    # light:/dark: themes resolve differently per appearance, so the output
+    # path doubles as the cache variant.
+    parsed = load_ghostty_config(
+        args.ghostty_cmd, variant=str(output_path), use_cache=not args.force
+    )
     if parsed:
-        rendered = ensure_palette_name(rendered)
-        rendered = update_palette_section(rendered, build_starship_palette(parsed))
+        # Split once and let both transforms edit the same line list
+        lines = ensure_palette_name(template_text.splitlines())
+        lines = update_palette_section(lines, build_starship_palette(parsed))
+        rendered = "\n".join(lines) + "\n"
 
     write_if_changed(output_path, rendered)
+    if parsed:
+        signature = pipeline_signature(template_path, output_path, args.ghostty_cmd)
+        # The output is already written; a missing signature only costs a rerun
+        try:
+            write_if_changed(cache_path, signature + "\n")
+        except OSError:
+            pass
     return 0
 
 